@@ -1,58 +1,182 @@
-import xml.etree.ElementTree as ET
+from lxml import etree
 import requests
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
+import pyarrow.compute as pc
 import gzip
 import sqlite3
 import os
+import shutil
+import signal
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+# Bind pandas' missing-value marker from Arrow-backed columns as SQL NULL
+sqlite3.register_adapter(type(pd.NA), lambda _: None)
+
+# Column definitions shared by the raw and clean SQLite tables
+UNIPROT_COLUMNS = {
+    'primary_accession': 'TEXT',
+    'recommended_protein_name': 'TEXT',
+    'primary_gene_name': 'TEXT',
+    'species_common_name': 'TEXT',
+    'string_dbReference': 'TEXT',
+    'opentargets_dbReference': 'TEXT',
+    'sequence_length': 'INTEGER',
+    'sequence_mass': 'REAL'
+}
+STRING_COLUMNS = {'protein1': 'TEXT', 'protein2': 'TEXT', 'combined_score': 'REAL'}
+OPENTARGETS_COLUMNS = {'id': 'TEXT', 'approvedSymbol': 'TEXT', 'biotype': 'TEXT'}
+SEMANTIC_COLUMNS = {
+    'primary_accession': 'TEXT',
+    'recommended_protein_name': 'TEXT',
+    'primary_gene_name': 'TEXT',
+    'species_common_name': 'TEXT',
+    'disease': 'TEXT',
+    'associated_proteins': 'TEXT'
+}
+
+# Minimum STRING combined_score for an interaction to be kept
+STRING_SCORE_THRESHOLD = 200
+
+# UniProt XML field extractors, compiled once at import time. Smart strings are disabled so
+# extracted values are plain str objects that don't keep the parsed entry alive.
+UNIPROT_NAMESPACE = {'uniprot': 'http://uniprot.org/uniprot'}
+
+
+def compile_xpath(path):
+    return etree.XPath(path, namespaces=UNIPROT_NAMESPACE, smart_strings=False)
+
+
+XPATH_ACCESSION = compile_xpath('uniprot:accession/text()')
+XPATH_PROTEIN_NAME = compile_xpath('uniprot:protein/uniprot:recommendedName/uniprot:fullName/text()')
+XPATH_GENE_NAME = compile_xpath("uniprot:gene/uniprot:name[@type='primary']/text()")
+XPATH_SPECIES_NAME = compile_xpath("uniprot:organism/uniprot:name[@type='common']/text()")
+XPATH_STRING_REF = compile_xpath("uniprot:dbReference[@type='STRING']/@id")
+XPATH_OPENTARGETS_REF = compile_xpath("uniprot:dbReference[@type='OpenTargets']/@id")
+
+# Namespace-qualified tags, resolved once rather than per entry
+UNIPROT_ENTRY_TAG = '{http://uniprot.org/uniprot}entry'
+UNIPROT_SEQUENCE_TAG = '{http://uniprot.org/uniprot}sequence'
 
 
 # Helper function for downloading files
-def download_file(url, filepath):
-    response = requests.get(url)
-    with open(filepath, 'wb') as f:
-        f.write(response.content)
-
-
-# Helper function for reading compressed files
-def read_gzip_file(filepath, mode='rt'):
-    with gzip.open(filepath, mode) as f:
-        return f
-
-
-# Reusable function for saving DataFrame to CSV
-def save_to_csv(df, filepath):
-    df.to_csv(filepath, index=False)
+def download_file(url, filepath, chunk_size=1 << 20):
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(filepath, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+
+# Helper function for decompressing gzip files in parallel where a multi-threaded decoder is available
+@contextlib.contextmanager
+def open_gzip(filepath):
+    if rapidgzip is not None:
+        with rapidgzip.open(filepath, parallelization=os.cpu_count()) as f:
+            yield f
+    elif shutil.which('pigz'):
+        with subprocess.Popen(['pigz', '-dc', filepath], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            yield proc.stdout
+            proc.stdout.close()
+            stderr = proc.stderr.read()
+            # A reader that stops early closes the pipe, which ends pigz with SIGPIPE; any other non-zero exit
+            # means the data is incomplete
+            if proc.wait() not in (0, -signal.SIGPIPE):
+                raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr)
+    else:
+        with gzip.open(filepath, 'rb') as f:
+            yield f
+
+
+# Helper function for extracting the first XPath match from an XML element
+def first_match(element, xpath):
+    matches = xpath(element)
+    return matches[0] if matches else ''
+
+
+# Helper function for opening the SQLite database with write-friendly settings
+def connect_db(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-262144;
+    """)
+    return conn
+
+
+# Reusable function for checkpointing a DataFrame to parquet, enabled with the ETL_CHECKPOINT env variable
+def save_checkpoint(df, filepath):
+    if os.environ.get('ETL_CHECKPOINT'):
+        df.to_parquet(filepath, engine='pyarrow', compression='zstd', index=False)
 
 
 # Step 1: Extract data from UniProt (XML)
-def fetch_uniprot_data(record_limit=1000, xml_filepath="uniprot_sprot.xml.gz"):
+def fetch_uniprot_data(record_limit=None, xml_filepath="uniprot_sprot.xml.gz"):
     url = "https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/uniprot_sprot.xml.gz"
     download_file(url, xml_filepath)
 
-    # Extract and parse XML
-    with gzip.open(xml_filepath, "rb") as f:
-        tree = ET.parse(f)
-        root = tree.getroot()
-
-    namespace = {'uniprot': 'http://uniprot.org/uniprot'}
-    data = []
-
-    for entry in root.findall('uniprot:entry', namespace):
-        data.append({
-            'Primary Accession': entry.find('uniprot:accession', namespace).text,
-            'Recommended Protein Name': (entry.find('uniprot:protein/uniprot:recommendedName/uniprot:fullName',
-                                                    namespace) or {}).text or '',
-            'Species Common Name': (entry.find("uniprot:organism/uniprot:name[@type='common']",
-                                               namespace) or {}).text or '',
-            'STRING dbReference': (entry.find("uniprot:dbReference[@type='STRING']", namespace) or {}).get('id', ''),
-            'OpenTargets dbReference': (entry.find("uniprot:dbReference[@type='OpenTargets']", namespace) or {}).get(
-                'id', ''),
-            'Sequence Length': (entry.find('uniprot:sequence', namespace) or {}).get('length', ''),
-            'Sequence Mass': (entry.find('uniprot:sequence', namespace) or {}).get('mass', '')
-        })
-
-    df = pd.DataFrame(data)
-    save_to_csv(df, 'uniprot_data.csv')
+    # Collect each field into its own column list rather than building a dict per entry
+    accessions, protein_names, gene_names, species_names = [], [], [], []
+    string_refs, opentargets_refs, sequence_lengths, sequence_masses = [], [], [], []
+
+    # The loop body runs once per UniProt entry, so bind the list appends to locals up front
+    append_accession, append_protein_name = accessions.append, protein_names.append
+    append_gene_name, append_species_name = gene_names.append, species_names.append
+    append_string_ref, append_opentargets_ref = string_refs.append, opentargets_refs.append
+    append_sequence_length, append_sequence_mass = sequence_lengths.append, sequence_masses.append
+    match = first_match
+
+    # Stream the XML entry by entry instead of building the whole tree in memory
+    with open_gzip(xml_filepath) as f:
+        context = etree.iterparse(f, events=("end",), tag=UNIPROT_ENTRY_TAG, huge_tree=True)
+
+        for count, (_, entry) in enumerate(context, 1):
+            append_accession(match(entry, XPATH_ACCESSION))
+            append_protein_name(match(entry, XPATH_PROTEIN_NAME))
+            append_gene_name(match(entry, XPATH_GENE_NAME))
+            append_species_name(match(entry, XPATH_SPECIES_NAME))
+            append_string_ref(match(entry, XPATH_STRING_REF))
+            append_opentargets_ref(match(entry, XPATH_OPENTARGETS_REF))
+
+            # Look the sequence element up once for both of its attributes
+            sequence = entry.find(UNIPROT_SEQUENCE_TAG)
+            if sequence is not None:
+                append_sequence_length(int(sequence.get('length') or 0))
+                append_sequence_mass(float(sequence.get('mass') or 0))
+            else:
+                append_sequence_length(0)
+                append_sequence_mass(0.0)
+
+            # Drop the processed entry so memory stays bounded by a single record
+            entry.clear()
+            while entry.getprevious() is not None:
+                del entry.getparent()[0]
+
+            if record_limit and count >= record_limit:
+                break
+
+    df = pd.DataFrame({
+        'Primary Accession': accessions,
+        'Recommended Protein Name': protein_names,
+        'Primary Gene Name': gene_names,
+        'Species Common Name': species_names,
+        'STRING dbReference': string_refs,
+        'OpenTargets dbReference': opentargets_refs,
+        'Sequence Length': np.asarray(sequence_lengths, dtype=np.int32),
+        'Sequence Mass': np.asarray(sequence_masses, dtype=np.float32)
+    }, copy=False)
+    save_checkpoint(df, 'uniprot_data.parquet')
     return df
 
 
@@ -61,10 +185,26 @@ def fetch_string_data(string_filepath="string_data.tsv.gz"):
     url = "https://string-db.org/cgi/download?sessionId=baXq4yzPPB1H&species_text=Homo+sapiens"
     download_file(url, string_filepath)
 
-    with read_gzip_file(string_filepath) as f:
-        string_df = pd.read_csv(f, sep='\t')[['protein1', 'protein2', 'combined_score']]
+    # Parse with pyarrow's multi-threaded reader, keeping only the columns we need
+    with open_gzip(string_filepath) as f:
+        string_table = pacsv.read_csv(
+            f,
+            parse_options=pacsv.ParseOptions(delimiter='\t'),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=['protein1', 'protein2', 'combined_score'],
+                column_types={'protein1': pa.string(), 'protein2': pa.string(), 'combined_score': pa.float32()}
+            )
+        )
 
-    save_to_csv(string_df, 'string_data.csv')
+    # Drop low-confidence interactions before they reach pandas, cleaning or SQLite
+    string_table = string_table.filter(pc.greater(string_table['combined_score'], STRING_SCORE_THRESHOLD))
+    string_df = string_table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    # Protein ids repeat across millions of rows, so store them as categorical codes
+    string_df['protein1'] = string_df['protein1'].astype('category')
+    string_df['protein2'] = string_df['protein2'].astype('category')
+
+    save_checkpoint(string_df, 'string_data.parquet')
     return string_df
 
 
@@ -73,22 +213,14 @@ def fetch_opentargets_data(parquet_filepath="targets.parquet"):
     targets_url = "https://ftp.ebi.ac.uk/pub/databases/opentargets/platform/24.09/output/etl/parquet/targets/part-00000-b2a23987-7e43-4651-a89c-1eb34ec9f9f5-c000.snappy.parquet"
     download_file(targets_url, parquet_filepath)
 
-    targets_df = pd.read_parquet(parquet_filepath)[['id', 'approvedSymbol', 'biotype']]
-    save_to_csv(targets_df, 'targets_data.csv')
+    # Project the needed columns in the parquet reader so the rest are never decoded
+    targets_df = pd.read_parquet(parquet_filepath, columns=['id', 'approvedSymbol', 'biotype'], engine='pyarrow',
+                                 dtype_backend='pyarrow')
+    save_checkpoint(targets_df, 'targets_data.parquet')
     return targets_df
 
 
-# Step 4: Clean and normalize the data
-def clean_and_normalize_data(df, source_name):
-    df_clean = (df.dropna()
-                .drop_duplicates()
-                .applymap(lambda x: x.strip().lower() if isinstance(x, str) else x))
-
-    print(f"Data from {source_name} cleaned and normalized!")
-    return df_clean
-
-
-# Step 5: Create clean data tables in SQLite
+# Step 4: Create raw and clean data tables in SQLite
 def create_table_if_not_exists(conn, table_name, columns):
     cursor = conn.cursor()
     column_definitions = ', '.join([f"{col} {dtype}" for col, dtype in columns.items()])
@@ -96,86 +228,136 @@ def create_table_if_not_exists(conn, table_name, columns):
     conn.commit()
 
 
-def create_clean_data_tables(conn):
-    uniprot_columns = {
-        'primary_accession': 'TEXT',
-        'recommended_protein_name': 'TEXT',
-        'primary_gene_name': 'TEXT',
-        'species_common_name': 'TEXT',
-        'string_dbReference': 'TEXT',
-        'opentargets_dbReference': 'TEXT',
-        'sequence_length': 'TEXT',
-        'sequence_mass': 'TEXT'
-    }
-    string_columns = {'protein1': 'TEXT', 'protein2': 'TEXT', 'combined_score': 'REAL'}
-    opentargets_columns = {'id': 'TEXT', 'approvedSymbol': 'TEXT', 'biotype': 'TEXT'}
-    semantic_columns = {
-        'primary_accession': 'TEXT',
-        'recommended_protein_name': 'TEXT',
-        'primary_gene_name': 'TEXT',
-        'species_common_name': 'TEXT',
-        'disease': 'TEXT',
-        'associated_proteins': 'TEXT'
-    }
-
-    create_table_if_not_exists(conn, 'clean_uniprot', uniprot_columns)
-    create_table_if_not_exists(conn, 'clean_string', string_columns)
-    create_table_if_not_exists(conn, 'clean_targets', opentargets_columns)
-    create_table_if_not_exists(conn, 'semantic_layer', semantic_columns)
+def create_raw_data_tables(conn):
+    create_table_if_not_exists(conn, 'raw_uniprot', UNIPROT_COLUMNS)
+    create_table_if_not_exists(conn, 'raw_string', STRING_COLUMNS)
+    create_table_if_not_exists(conn, 'raw_targets', OPENTARGETS_COLUMNS)
 
-    print("Clean data tables created successfully!")
+    print("Raw data tables created successfully!")
 
 
-# Step 6: Insert cleaned data into the clean tables
-def insert_cleaned_data(df, table_name, conn):
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
-    print(f"Cleaned data inserted into '{table_name}' successfully!")
+def create_clean_data_tables(conn):
+    create_table_if_not_exists(conn, 'clean_uniprot', UNIPROT_COLUMNS)
+    create_table_if_not_exists(conn, 'clean_string', STRING_COLUMNS)
+    create_table_if_not_exists(conn, 'clean_targets', OPENTARGETS_COLUMNS)
+    create_table_if_not_exists(conn, 'semantic_layer', SEMANTIC_COLUMNS)
 
+    print("Clean data tables created successfully!")
 
-# Step 7: Create the Semantic Data Layer
+
+# Step 5: Insert raw data, then clean it into the clean tables inside SQLite
+def bulk_insert(df, table_name, conn):
+    # Reload into the existing table so its schema and indexes survive, in a single transaction.
+    # Syncing to disk is skipped during the bulk load and the previous setting restored afterwards.
+    placeholders = ', '.join('?' * len(df.columns))
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        with conn:
+            conn.execute(f"DELETE FROM {table_name}")
+            conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})",
+                             df.itertuples(index=False, name=None))
+    finally:
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+
+
+def insert_raw_data(df, table_name, conn):
+    bulk_insert(df, table_name, conn)
+    print(f"Raw data inserted into '{table_name}' successfully!")
+
+
+def clean_raw_data(conn, raw_table, clean_table, columns):
+    # Skip rows with a NULL in any column, trim tabs, newlines, carriage returns and spaces from TEXT columns
+    # and lowercase them (SQLite's lower() folds ASCII letters only), then de-duplicate the normalized rows.
+    # SQLite does all of this in one pass without copying rows into pandas. The raw rows are then deleted
+    # so the database doesn't keep a second full copy of every source.
+    select_list = ', '.join(f"lower(trim({col}, char(9, 10, 13, 32)))" if dtype == 'TEXT' else col
+                            for col, dtype in columns.items())
+    not_null = ' AND '.join(f"{col} IS NOT NULL" for col in columns)
+    with conn:
+        conn.execute(f"DELETE FROM {clean_table}")
+        conn.execute(f"INSERT INTO {clean_table} SELECT DISTINCT {select_list} FROM {raw_table} WHERE {not_null}")
+        conn.execute(f"DELETE FROM {raw_table}")
+    print(f"Data from '{raw_table}' cleaned and normalized into '{clean_table}'!")
+
+
+def create_join_indexes(conn):
+    # The STRING and OpenTargets indexes also carry the columns the semantic layer reads,
+    # so its joins are answered from the sorted index without touching the table rows
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS ix_string_protein1_score_protein2
+            ON clean_string(protein1, combined_score, protein2);
+        CREATE INDEX IF NOT EXISTS ix_targets_id_symbol ON clean_targets(id, approvedSymbol);
+        CREATE INDEX IF NOT EXISTS ix_uniprot_string_ref ON clean_uniprot(string_dbReference);
+        CREATE INDEX IF NOT EXISTS ix_uniprot_opentargets_ref ON clean_uniprot(opentargets_dbReference);
+    """)
+    print("Join key indexes created successfully!")
+
+
+# Step 6: Create the Semantic Data Layer
 def create_semantic_layer(conn):
-    uniprot_df = pd.read_sql('SELECT * FROM clean_uniprot', conn)
-    string_df = pd.read_sql('SELECT * FROM clean_string', conn)
-    opentargets_df = pd.read_sql('SELECT * FROM clean_targets', conn)
-
-    semantic_layer_df = (
-        uniprot_df
-        .merge(string_df[string_df['combined_score'] > 200], left_on='string_dbReference', right_on='protein1',
-               how='left')
-        .merge(opentargets_df, left_on='opentargets_dbReference', right_on='id', how='left')
-        .groupby(['primary_accession', 'recommended_protein_name', 'primary_gene_name', 'species_common_name'])
-        .agg(
-            disease=('approvedSymbol', lambda x: ', '.join(x.dropna().unique())),
-            associated_proteins=('protein2', lambda x: ', '.join(x.dropna().unique()))
-        )
-        .reset_index()
-    )
+    # Join and aggregate inside SQLite rather than pulling every table into pandas. Each side is
+    # de-duplicated once and joined separately, so proteins and targets are never cross-multiplied.
+    with conn:
+        conn.execute("DELETE FROM semantic_layer")
+        conn.execute("""
+            INSERT INTO semantic_layer (primary_accession, recommended_protein_name, primary_gene_name,
+                                        species_common_name, disease, associated_proteins)
+            WITH proteins AS (
+                SELECT DISTINCT u.primary_accession, u.recommended_protein_name, u.primary_gene_name,
+                                u.species_common_name, s.protein2
+                FROM clean_uniprot u
+                LEFT JOIN clean_string s ON s.protein1 = u.string_dbReference AND s.combined_score > ?
+            ),
+            diseases AS (
+                SELECT DISTINCT u.primary_accession, u.recommended_protein_name, u.primary_gene_name,
+                                u.species_common_name, t.approvedSymbol
+                FROM clean_uniprot u
+                LEFT JOIN clean_targets t ON t.id = u.opentargets_dbReference
+            )
+            SELECT primary_accession, recommended_protein_name, primary_gene_name, species_common_name,
+                   COALESCE(d.disease, ''), COALESCE(p.associated_proteins, '')
+            FROM (
+                SELECT primary_accession, recommended_protein_name, primary_gene_name, species_common_name,
+                       GROUP_CONCAT(protein2, ', ') AS associated_proteins
+                FROM proteins
+                GROUP BY primary_accession, recommended_protein_name, primary_gene_name, species_common_name
+            ) p
+            JOIN (
+                SELECT primary_accession, recommended_protein_name, primary_gene_name, species_common_name,
+                       GROUP_CONCAT(approvedSymbol, ', ') AS disease
+                FROM diseases
+                GROUP BY primary_accession, recommended_protein_name, primary_gene_name, species_common_name
+            ) d USING (primary_accession, recommended_protein_name, primary_gene_name, species_common_name)
+        """, (STRING_SCORE_THRESHOLD,))
 
-    insert_cleaned_data(semantic_layer_df, 'semantic_layer', conn)
     print("Semantic Layer table created successfully!")
 
 
-# Step 8: Main function to fetch, clean, and insert cleaned data
+# Step 7: Main function to fetch, load, and clean the data
 def main():
-    conn = sqlite3.connect('etl_pipeline.db')
-
-    # Fetch raw data
-    uniprot_df = fetch_uniprot_data()
-    string_df = fetch_string_data()
-    opentargets_df = fetch_opentargets_data()
-
-    # Clean and normalize data
-    clean_uniprot_df = clean_and_normalize_data(uniprot_df, 'UniProt')
-    clean_string_df = clean_and_normalize_data(string_df, 'STRING')
-    clean_opentargets_df = clean_and_normalize_data(opentargets_df, 'OpenTargets')
+    conn = connect_db('etl_pipeline.db')
 
-    # Create clean data tables
+    # Create raw and clean data tables
+    create_raw_data_tables(conn)
     create_clean_data_tables(conn)
 
-    # Insert cleaned data into clean tables
-    insert_cleaned_data(clean_uniprot_df, 'clean_uniprot', conn)
-    insert_cleaned_data(clean_string_df, 'clean_string', conn)
-    insert_cleaned_data(clean_opentargets_df, 'clean_targets', conn)
+    # Fetch raw data; the three sources are independent, so download and parse them concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {
+            executor.submit(fetch_uniprot_data): ('raw_uniprot', 'clean_uniprot', UNIPROT_COLUMNS),
+            executor.submit(fetch_string_data): ('raw_string', 'clean_string', STRING_COLUMNS),
+            executor.submit(fetch_opentargets_data): ('raw_targets', 'clean_targets', OPENTARGETS_COLUMNS)
+        }
+
+        # Insert raw data and clean it into the clean tables inside SQLite as each source becomes
+        # available. SQLite writes stay serial on this thread's connection.
+        for future in as_completed(futures):
+            raw_table, clean_table, columns = futures[future]
+            insert_raw_data(future.result(), raw_table, conn)
+            clean_raw_data(conn, raw_table, clean_table, columns)
+
+    create_join_indexes(conn)
 
     # Create Semantic Layer
     create_semantic_layer(conn)
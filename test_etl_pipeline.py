@@ -3,20 +3,57 @@ import pandas as pd
 import sqlite3
 import requests
 import gzip
+import os
+import subprocess
+import pytest
+import pyarrow.parquet as pq
 from unittest import mock
 from ETL_pipeline import (
-    fetch_uniprot_data, fetch_string_data, fetch_opentargets_data,
-    clean_and_normalize_data, create_clean_data_tables, insert_cleaned_data,
-    create_semantic_layer, main  # Import main function here
+    download_file, open_gzip, save_checkpoint, fetch_uniprot_data, fetch_string_data, fetch_opentargets_data,
+    create_table_if_not_exists, create_raw_data_tables, create_clean_data_tables,
+    bulk_insert, insert_raw_data, clean_raw_data, create_join_indexes, create_semantic_layer,
+    STRING_COLUMNS, main  # Import main function here
 )
 
 
+# Test that a failing pigz decompression is reported instead of returning partial data
+@mock.patch('ETL_pipeline.rapidgzip', None)
+def test_open_gzip_pigz_failure(tmp_path, monkeypatch):
+    pigz = tmp_path / 'pigz'
+    pigz.write_text("#!/bin/sh\necho 'protein1'\necho 'corrupt input' >&2\nexit 1\n")
+    pigz.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        with open_gzip(str(tmp_path / 'data.gz')) as f:
+            f.read()
+    assert b'corrupt input' in excinfo.value.stderr
+
+
+# Test that checkpoints are only written when ETL_CHECKPOINT is set
+def test_save_checkpoint(tmp_path, monkeypatch):
+    df = pd.DataFrame({
+        'protein1': pd.Categorical(['9606.ensp1', '9606.ensp1']),
+        'combined_score': [900.0, 700.0]
+    })
+    filepath = tmp_path / 'string_data.parquet'
+
+    monkeypatch.delenv('ETL_CHECKPOINT', raising=False)
+    save_checkpoint(df, str(filepath))
+    assert not filepath.exists()
+
+    monkeypatch.setenv('ETL_CHECKPOINT', '1')
+    save_checkpoint(df, str(filepath))
+    assert pq.ParquetFile(filepath).metadata.row_group(0).column(0).compression == 'ZSTD'
+    pd.testing.assert_frame_equal(pd.read_parquet(filepath), df)
+
+
 # Test fetching UniProt data
 @mock.patch('ETL_pipeline.requests.get')  # Correct patch path
 def test_fetch_uniprot_data(mock_get):
     # Simulate gzipped XML content
-    mock_get.return_value.content = gzip.compress(b"""<?xml version="1.0"?>
-    <uniprot>
+    mock_get.return_value.__enter__.return_value.iter_content.return_value = [gzip.compress(b"""<?xml version="1.0"?>
+    <uniprot xmlns="http://uniprot.org/uniprot">
         <entry>
             <accession>P12345</accession>
             <protein>
@@ -27,22 +64,39 @@ def test_fetch_uniprot_data(mock_get):
             </organism>
             <dbReference type="STRING" id="9606.ENSP00000354587"/>
             <dbReference type="OpenTargets" id="ENSG00000141510"/>
+            <sequence length="393" mass="43653"/>
         </entry>
-    </uniprot>""")
+    </uniprot>""")]
 
     df = fetch_uniprot_data(record_limit=1)
     assert not df.empty
     assert 'Primary Accession' in df.columns
+    assert df['Sequence Length'].iloc[0] == 393
+    assert df['Sequence Mass'].iloc[0] == 43653.0
+
+
+# Test that every UniProt entry is loaded unless a record limit is given
+@mock.patch('ETL_pipeline.requests.get')
+def test_fetch_uniprot_data_record_limit(mock_get):
+    entries = b"".join(b"<entry><accession>P%d</accession></entry>" % i for i in range(3))
+    xml_data = gzip.compress(b'<uniprot xmlns="http://uniprot.org/uniprot">' + entries + b'</uniprot>')
+    mock_get.return_value.__enter__.return_value.iter_content.return_value = [xml_data]
+
+    assert len(fetch_uniprot_data()) == 3
+    assert len(fetch_uniprot_data(record_limit=2)) == 2
 
 
 # Test fetching STRING data
 @mock.patch('ETL_pipeline.requests.get')  # Correct patch path
 def test_fetch_string_data(mock_get):
     # Simulate gzipped TSV content
-    mock_get.return_value.content = gzip.compress(b"protein1\tprotein2\tcombined_score\n"
-                                                  b"9606.ENSP00000354587\t9606.ENSP00000354588\t900\n")
+    tsv_data = gzip.compress(b"protein1\tprotein2\tcombined_score\n"
+                             b"9606.ENSP00000354587\t9606.ENSP00000354588\t900\n"
+                             b"9606.ENSP00000354587\t9606.ENSP00000354589\t150\n")
+    mock_get.return_value.__enter__.return_value.iter_content.return_value = [tsv_data]
     df = fetch_string_data()
     assert not df.empty
+    assert len(df) == 1
     assert 'protein1' in df.columns
     assert 'protein2' in df.columns
 
@@ -57,21 +111,19 @@ def test_fetch_opentargets_data(mock_get):
         'biotype': ['protein_coding']
     }).to_parquet()
 
-    mock_get.return_value.content = parquet_data
+    mock_get.return_value.__enter__.return_value.iter_content.return_value = [parquet_data]
     df = fetch_opentargets_data()
     assert not df.empty
     assert 'id' in df.columns
 
 
-# Test cleaning and normalizing data
-def test_clean_and_normalize_data():
-    df = pd.DataFrame({
-        'col1': [' Value1 ', None, 'value1'],
-        'col2': [' DUPLICATE ', 'duplicate', None]
-    })
-    cleaned_df = clean_and_normalize_data(df, 'test_source')
-    assert cleaned_df.shape[0] == 1
-    assert cleaned_df['col1'].iloc[0] == 'value1'
+# Test that a failed HTTP response is raised instead of being written to disk
+@mock.patch('ETL_pipeline.requests.get')
+def test_download_file_http_error(mock_get, tmp_path):
+    mock_get.return_value.__enter__.return_value.raise_for_status.side_effect = requests.HTTPError('404')
+    with pytest.raises(requests.HTTPError):
+        download_file('https://example.org/missing', str(tmp_path / 'missing.gz'))
+    assert not (tmp_path / 'missing.gz').exists()
 
 
 # Test SQLite table creation
@@ -84,43 +136,91 @@ def test_create_clean_data_tables():
     assert ('clean_uniprot',) in tables
 
 
-# Test inserting cleaned data into SQLite
-def test_insert_cleaned_data():
+# Test bulk inserting data into SQLite
+def test_bulk_insert():
     conn = sqlite3.connect(':memory:')
     df = pd.DataFrame({
         'col1': ['value1', 'value2'],
         'col2': [10, 20]
     })
-    insert_cleaned_data(df, 'test_table', conn)
+    create_table_if_not_exists(conn, 'test_table', {'col1': 'TEXT', 'col2': 'INTEGER'})
     cursor = conn.cursor()
+    synchronous = cursor.execute("PRAGMA synchronous").fetchone()
+    bulk_insert(df, 'test_table', conn)
+    # Reloading replaces the rows instead of appending to them
+    bulk_insert(df, 'test_table', conn)
     cursor.execute("SELECT * FROM test_table")
     rows = cursor.fetchall()
     assert len(rows) == 2
+    assert cursor.execute("PRAGMA synchronous").fetchone() == synchronous
+
+    # A failed load is rolled back and still restores the synchronous setting
+    with pytest.raises(sqlite3.OperationalError):
+        bulk_insert(df.assign(col3=[1, 2]), 'test_table', conn)
+    cursor.execute("SELECT * FROM test_table")
+    assert len(cursor.fetchall()) == 2
+    assert cursor.execute("PRAGMA synchronous").fetchone() == synchronous
+
+
+# Test cleaning raw data into the clean tables inside SQLite
+def test_clean_raw_data():
+    conn = sqlite3.connect(':memory:')
+    create_raw_data_tables(conn)
+    create_clean_data_tables(conn)
+    df = pd.DataFrame({
+        'protein1': pd.Categorical([' ENSP1 ', 'ensp1', None]),
+        'protein2': ['ENSP2', 'ensp2', 'ENSP3'],
+        'combined_score': [900, 900, 700]
+    })
+    insert_raw_data(df, 'raw_string', conn)
+    clean_raw_data(conn, 'raw_string', 'clean_string', STRING_COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM clean_string")
+    rows = cursor.fetchall()
+    assert rows == [('ensp1', 'ensp2', 900.0)]
+    cursor.execute("SELECT COUNT(*) FROM raw_string")
+    assert cursor.fetchone() == (0,)
+
+
+# Test join key index creation
+def test_create_join_indexes():
+    conn = sqlite3.connect(':memory:')
+    create_clean_data_tables(conn)
+    create_join_indexes(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='index';")
+    indexes = cursor.fetchall()
+    assert ('ix_string_protein1_score_protein2',) in indexes
+    assert ('ix_targets_id_symbol',) in indexes
 
 
 # Test semantic layer creation
 def test_create_semantic_layer():
     conn = sqlite3.connect(':memory:')
+    create_clean_data_tables(conn)
     # Mock data in the database
     uniprot_df = pd.DataFrame({
         'primary_accession': ['P12345'],
         'recommended_protein_name': ['Protein1'],
-        'string_dbReference': ['9606.ENSP00000354587']
+        'primary_gene_name': ['GENE1'],
+        'species_common_name': ['Human'],
+        'string_dbReference': ['9606.ENSP00000354587'],
+        'opentargets_dbReference': ['ENSG00000141510']
     })
-    uniprot_df.to_sql('clean_uniprot', conn, index=False)
+    uniprot_df.to_sql('clean_uniprot', conn, if_exists='append', index=False)
 
     string_df = pd.DataFrame({
-        'protein1': ['9606.ENSP00000354587'],
-        'protein2': ['9606.ENSP00000354588'],
-        'combined_score': [900]
+        'protein1': ['9606.ENSP00000354587', '9606.ENSP00000354587', '9606.ENSP00000354587'],
+        'protein2': ['9606.ENSP00000354588', '9606.ENSP00000354589', '9606.ENSP00000354590'],
+        'combined_score': [900, 700, 150]
     })
-    string_df.to_sql('clean_string', conn, index=False)
+    string_df.to_sql('clean_string', conn, if_exists='append', index=False)
 
     opentargets_df = pd.DataFrame({
         'id': ['ENSG00000141510'],
         'approvedSymbol': ['BRCA1']
     })
-    opentargets_df.to_sql('clean_targets', conn, index=False)
+    opentargets_df.to_sql('clean_targets', conn, if_exists='append', index=False)
 
     create_semantic_layer(conn)
 
@@ -128,13 +228,15 @@ def test_create_semantic_layer():
     cursor.execute("SELECT * FROM semantic_layer")
     rows = cursor.fetchall()
     assert len(rows) > 0
+    assert rows[0][4] == 'BRCA1'
+    assert sorted(rows[0][5].split(', ')) == ['9606.ENSP00000354588', '9606.ENSP00000354589']
 
 
 # Test main flow
 @mock.patch('ETL_pipeline.requests.get')  # Correct patch path
 def test_main(mock_get):
     # Simulate request content
-    mock_get.return_value.content = b'fake data'
+    mock_get.return_value.__enter__.return_value.iter_content.return_value = [b'fake data']
     conn = sqlite3.connect(':memory:')  # Use in-memory database for testing
 
     # Call the main function to test the entire ETL process